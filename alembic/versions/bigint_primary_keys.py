@@ -0,0 +1,52 @@
+"""bigint primary keys
+
+Revision ID: bigint_primary_keys
+Revises: generated_search_vectors
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'bigint_primary_keys'
+down_revision = 'generated_search_vectors'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Indexes duplicating the primary keys, created by index=True on the id columns
+    op.execute('DROP INDEX IF EXISTS ix_subscriptions_id')
+    op.execute('DROP INDEX IF EXISTS ix_webhook_deliveries_id')
+    op.execute('DROP INDEX IF EXISTS ix_delivery_attempts_id')
+
+    # Widen keys before 32-bit ids run out; each ALTER rewrites its table
+    op.execute('ALTER TABLE subscriptions ALTER COLUMN id TYPE bigint')
+    op.execute('ALTER SEQUENCE subscriptions_id_seq AS bigint')
+    op.execute(
+        'ALTER TABLE webhook_deliveries '
+        'ALTER COLUMN id TYPE bigint, '
+        'ALTER COLUMN subscription_id TYPE bigint'
+    )
+    op.execute('ALTER SEQUENCE webhook_deliveries_id_seq AS bigint')
+    op.execute(
+        'ALTER TABLE delivery_attempts '
+        'ALTER COLUMN id TYPE bigint, '
+        'ALTER COLUMN delivery_id TYPE bigint'
+    )
+    op.execute('ALTER SEQUENCE delivery_attempts_id_seq AS bigint')
+
+def downgrade() -> None:
+    op.execute('ALTER SEQUENCE delivery_attempts_id_seq AS integer')
+    op.execute(
+        'ALTER TABLE delivery_attempts '
+        'ALTER COLUMN delivery_id TYPE integer, '
+        'ALTER COLUMN id TYPE integer'
+    )
+    op.execute('ALTER SEQUENCE webhook_deliveries_id_seq AS integer')
+    op.execute(
+        'ALTER TABLE webhook_deliveries '
+        'ALTER COLUMN subscription_id TYPE integer, '
+        'ALTER COLUMN id TYPE integer'
+    )
+    op.execute('ALTER SEQUENCE subscriptions_id_seq AS integer')
+    op.execute('ALTER TABLE subscriptions ALTER COLUMN id TYPE integer')
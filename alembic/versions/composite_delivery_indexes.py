@@ -0,0 +1,46 @@
+"""composite delivery indexes
+
+Revision ID: composite_delivery_indexes
+Revises: initial
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'composite_delivery_indexes'
+down_revision = 'initial'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        # Serves WHERE subscription_id = ? ORDER BY created_at DESC LIMIT n
+        # straight from the index; subsumes the single-column subscription_id index
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_webhook_deliveries_subscription_id_created_at '
+            'ON webhook_deliveries (subscription_id, created_at DESC)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_webhook_deliveries_subscription_id')
+
+        # Serves attempt lookups ordered by attempt_number; subsumes the delivery_id index
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_delivery_attempts_delivery_id_attempt_number '
+            'ON delivery_attempts (delivery_id, attempt_number)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_delivery_attempts_delivery_id')
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_delivery_attempts_delivery_id '
+            'ON delivery_attempts (delivery_id)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_delivery_attempts_delivery_id_attempt_number')
+
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_webhook_deliveries_subscription_id '
+            'ON webhook_deliveries (subscription_id)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_webhook_deliveries_subscription_id_created_at')
@@ -0,0 +1,23 @@
+"""delivery payload raw
+
+Revision ID: delivery_payload_raw
+Revises: bigint_primary_keys
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'delivery_payload_raw'
+down_revision = 'bigint_primary_keys'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Encoded request body, written at ingest; existing rows stay NULL and
+    # are encoded from payload by the worker's query
+    op.add_column('webhook_deliveries', sa.Column('payload_raw', sa.LargeBinary(), nullable=True))
+
+def downgrade() -> None:
+    op.drop_column('webhook_deliveries', 'payload_raw')
@@ -0,0 +1,48 @@
+"""generated search vectors
+
+Revision ID: generated_search_vectors
+Revises: partial_retry_index
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'generated_search_vectors'
+down_revision = 'partial_retry_index'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Let PostgreSQL maintain the search vectors so every write path,
+    # including COPY and bulk inserts, keeps them current
+    op.execute(
+        'ALTER TABLE subscriptions '
+        'DROP COLUMN IF EXISTS search_vector, '
+        "ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', name)) STORED"
+    )
+    op.execute(
+        'ALTER TABLE webhook_deliveries '
+        'DROP COLUMN IF EXISTS payload_search, '
+        'ADD COLUMN payload_search tsvector GENERATED ALWAYS AS '
+        "(to_tsvector('english', jsonb_path_query_array(payload, '$.*'))) STORED"
+    )
+
+    # Dropping the columns removed any GIN indexes on them
+    op.create_index('ix_subscriptions_search_vector', 'subscriptions', ['search_vector'], postgresql_using='gin')
+    op.create_index('ix_webhook_deliveries_payload_search', 'webhook_deliveries', ['payload_search'], postgresql_using='gin')
+
+def downgrade() -> None:
+    op.drop_index('ix_webhook_deliveries_payload_search', table_name='webhook_deliveries')
+    op.drop_index('ix_subscriptions_search_vector', table_name='subscriptions')
+
+    op.execute(
+        'ALTER TABLE webhook_deliveries '
+        'DROP COLUMN payload_search, '
+        'ADD COLUMN payload_search tsvector'
+    )
+    op.execute(
+        'ALTER TABLE subscriptions '
+        'DROP COLUMN search_vector, '
+        'ADD COLUMN search_vector tsvector'
+    )
@@ -0,0 +1,53 @@
+"""partial retry index
+
+Revision ID: partial_retry_index
+Revises: composite_delivery_indexes
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'partial_retry_index'
+down_revision = 'composite_delivery_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Databases created with init_db.py got the enum member names as labels
+    # ('PENDING', ...); rename them to the lowercase values used by the
+    # initial migration and the ORM, so the index predicate below matches
+    op.execute(
+        """
+        DO $$
+        DECLARE label text;
+        BEGIN
+            FOREACH label IN ARRAY ARRAY['pending', 'success', 'failed', 'retrying'] LOOP
+                IF EXISTS (
+                    SELECT 1 FROM pg_enum e JOIN pg_type t ON t.oid = e.enumtypid
+                    WHERE t.typname = 'deliverystatus' AND e.enumlabel = upper(label)
+                ) THEN
+                    EXECUTE format('ALTER TYPE deliverystatus RENAME VALUE %L TO %L', upper(label), label);
+                END IF;
+            END LOOP;
+        END $$;
+        """
+    )
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        # Only rows still waiting for delivery are indexed, so the index stays
+        # small as successful and failed deliveries accumulate
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_webhook_deliveries_next_retry_at_due '
+            'ON webhook_deliveries (next_retry_at) '
+            "WHERE status IN ('pending', 'retrying')"
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_webhook_deliveries_next_retry_at')
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_webhook_deliveries_next_retry_at '
+            'ON webhook_deliveries (next_retry_at)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_webhook_deliveries_next_retry_at_due')
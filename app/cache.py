@@ -1,39 +1,306 @@
-from redis import Redis
+from redis import asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import RedisError, ResponseError
 from app.config import get_settings
-import json
-from typing import Any, Optional
+import asyncio
+import hashlib
+import orjson
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+from cachetools import TTLCache
 
 settings = get_settings()
 
-redis_client = Redis.from_url(settings.REDIS_URL)
+# Set up logging
+logger = logging.getLogger(__name__)
 
-def get_subscription_from_cache(subscription_id: int) -> Optional[dict]:
-    """Get subscription details from cache"""
-    cached_data = redis_client.get(f"subscription:{subscription_id}")
+# Async client so cache calls don't block the event loop
+redis_client = aioredis.from_url(settings.REDIS_URL, decode_responses=False)
+
+# Channel announcing changed or deleted subscriptions to every process
+SUBSCRIPTION_INVALIDATION_CHANNEL = "subscription_invalidations"
+
+# Stream of delivery ids waiting to be sent, read by the consumer group in
+# app/consumer.py. Trimmed approximately so Redis memory stays bounded.
+DELIVERY_STREAM = "deliveries"
+DELIVERY_GROUP = "workers"
+DELIVERY_STREAM_MAXLEN = 1_000_000
+
+# Entries read but not acknowledged for this long belong to a consumer that
+# died mid-batch and are taken over by another. New deliveries are also due
+# for retry_due_deliveries after this long, in case their entry never made
+# it onto the stream or was trimmed from it.
+DELIVERY_STALE_MS = 300_000
+
+# Process-local tier in front of Redis so hot subscriptions skip the Redis
+# round trip. Bounded in size, and entries expire after a minute in case an
+# invalidation from listen_for_subscription_invalidations is missed.
+_local_subscriptions: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+@asynccontextmanager
+async def cache_pipeline() -> AsyncIterator[Pipeline]:
+    """Queue cache writes and send them in a single round trip on exit"""
+    async with redis_client.pipeline(transaction=False) as pipeline:
+        yield pipeline
+        await pipeline.execute()
+
+async def get_subscription_from_cache(subscription_id: int) -> Optional[dict]:
+    """Get subscription details from the local tier, then Redis"""
+    data = _local_subscriptions.get(subscription_id)
+    if data is not None:
+        return data
+    cached_data = await redis_client.get(f"subscription:{subscription_id}")
     if cached_data:
-        return json.loads(cached_data)
+        data = orjson.loads(cached_data)
+        _local_subscriptions[subscription_id] = data
+        return data
     return None
 
-def set_subscription_in_cache(subscription_id: int, data: dict) -> None:
-    """Set subscription details in cache"""
-    redis_client.setex(
+async def set_subscription_in_cache(
+    subscription_id: int,
+    data: dict,
+    pipeline: Optional[Pipeline] = None
+) -> None:
+    """Set subscription details in cache, queued on pipeline if given"""
+    client = pipeline if pipeline is not None else redis_client
+    await client.setex(
         f"subscription:{subscription_id}",
         3600,  # Cache for 1 hour
-        json.dumps(data)
+        orjson.dumps(data)
     )
 
-def delete_subscription_from_cache(subscription_id: int) -> None:
-    """Delete subscription from cache"""
-    redis_client.delete(f"subscription:{subscription_id}")
+async def warm_subscription(subscription_id: int, data: dict) -> None:
+    """Cache subscription details and release the population lock in one round trip"""
+    async with cache_pipeline() as pipeline:
+        await set_subscription_in_cache(subscription_id, data, pipeline)
+        pipeline.delete(f"subscription:{subscription_id}:lock")
 
-def get_delivery_status(delivery_id: int) -> Optional[str]:
-    """Get delivery status from cache"""
-    return redis_client.get(f"delivery_status:{delivery_id}")
+async def get_or_set_subscription(
+    subscription_id: int,
+    loader: Callable[[], Awaitable[Optional[dict]]],
+    attempts: int = 20
+) -> Optional[dict]:
+    """Get subscription details from cache, loading them at most once on a miss
 
-def set_delivery_status(delivery_id: int, status: str) -> None:
-    """Set delivery status in cache"""
-    redis_client.setex(
-        f"delivery_status:{delivery_id}",
-        3600,  # Cache for 1 hour
-        status
-    ) 
\ No newline at end of file
+    Only the caller holding the short-lived lock runs the loader; concurrent
+    callers poll the cache until it is populated and fall back to the loader
+    if it never is. Redis errors are treated as a miss, so reads keep working
+    from the database while Redis is down.
+    """
+    key = f"subscription:{subscription_id}"
+    locked = False
+    try:
+        for _ in range(attempts):
+            data = await get_subscription_from_cache(subscription_id)
+            if data is not None:
+                return data
+            if await redis_client.set(f"{key}:lock", "1", nx=True, ex=5):
+                locked = True
+                break
+            await asyncio.sleep(0.05)
+    except RedisError as e:
+        logger.warning("Subscription cache unavailable: %s", e)
+
+    if not locked:
+        return await loader()
+
+    try:
+        data = await loader()
+    except BaseException:
+        try:
+            await redis_client.delete(f"{key}:lock")
+        except RedisError:
+            pass  # The lock expires on its own
+        raise
+    try:
+        if data is None:
+            await redis_client.delete(f"{key}:lock")
+        else:
+            await warm_subscription(subscription_id, data)
+    except RedisError as e:
+        logger.warning("Failed to cache subscription %s: %s", subscription_id, e)
+    return data
+
+async def delete_subscription_from_cache(
+    subscription_id: int,
+    pipeline: Optional[Pipeline] = None
+) -> None:
+    """Delete subscription from cache, queued on pipeline if given"""
+    _local_subscriptions.pop(subscription_id, None)
+    client = pipeline if pipeline is not None else redis_client
+    await client.delete(f"subscription:{subscription_id}")
+
+async def publish_subscription_invalidation(
+    subscription_id: int,
+    pipeline: Optional[Pipeline] = None
+) -> None:
+    """Tell every process to evict a subscription from its local tier, queued on pipeline if given"""
+    client = pipeline if pipeline is not None else redis_client
+    await client.publish(SUBSCRIPTION_INVALIDATION_CHANNEL, subscription_id)
+
+async def listen_for_subscription_invalidations() -> None:
+    """Evict subscriptions from the local tier as invalidations arrive
+
+    Runs until cancelled. After a dropped connection the whole local tier is
+    cleared, since invalidations may have been missed.
+    """
+    while True:
+        try:
+            async with redis_client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(SUBSCRIPTION_INVALIDATION_CHANNEL)
+                _local_subscriptions.clear()
+                async for message in pubsub.listen():
+                    _local_subscriptions.pop(int(message["data"]), None)
+        except RedisError as e:
+            logger.warning("Subscription invalidation listener disconnected: %s", e)
+            _local_subscriptions.clear()
+            await asyncio.sleep(1)
+
+def debounce_key(subscription_id: int, event_type: str, data: dict) -> str:
+    """Build the debounce key for an event from a stable hash of its data"""
+    digest = hashlib.blake2b(
+        orjson.dumps(data, option=orjson.OPT_SORT_KEYS),
+        digest_size=16
+    ).hexdigest()
+    return f"debounce:{subscription_id}:{event_type}:{digest}"
+
+# Value held by a debounce key while its winner is still creating the delivery
+DEBOUNCE_PLACEHOLDER = b"pending"
+
+async def reserve_debounced_delivery(key: str, window: int, attempts: int = 20) -> Optional[int]:
+    """Claim a debounced event, or get the delivery another caller created for it
+
+    Returns None when this caller holds the key and must create the delivery
+    and record it with set_debounced_delivery. Concurrent callers poll while
+    the key holds the placeholder and, if the winner never records a delivery,
+    fall back to creating their own.
+    """
+    for _ in range(attempts):
+        if await redis_client.set(key, DEBOUNCE_PLACEHOLDER, ex=window, nx=True):
+            return None
+
+        delivery_id = await redis_client.get(key)
+        if delivery_id and delivery_id != DEBOUNCE_PLACEHOLDER:
+            return int(delivery_id)
+
+        await asyncio.sleep(0.05)
+
+    return None
+
+async def set_debounced_delivery(key: str, delivery_id: int, window: int) -> None:
+    """Record the delivery created for a reserved event for the debounce window"""
+    await redis_client.set(key, delivery_id, ex=window)
+
+async def release_debounced_delivery(key: str) -> None:
+    """Drop a reservation whose delivery could not be created"""
+    await redis_client.delete(key)
+
+async def get_delivery_status(subscription_id: int, delivery_id: int) -> Optional[bytes]:
+    """Get delivery status from the subscription's status hash"""
+    return await redis_client.hget(f"delivery_status:{subscription_id}", delivery_id)
+
+async def set_delivery_status(
+    subscription_id: int,
+    delivery_id: int,
+    status: str,
+    pipeline: Optional[Pipeline] = None
+) -> None:
+    """Set delivery status in the subscription's status hash, queued on pipeline if given
+
+    Statuses share one hash per subscription instead of a key per delivery;
+    the hash expires an hour after its last write and prune_status_hash
+    drops entries for deliveries past the retention period.
+    """
+    key = f"delivery_status:{subscription_id}"
+    if pipeline is not None:
+        pipeline.hset(key, delivery_id, status)
+        pipeline.expire(key, 3600)  # Cache for 1 hour
+        return
+
+    async with cache_pipeline() as pipeline:
+        pipeline.hset(key, delivery_id, status)
+        pipeline.expire(key, 3600)  # Cache for 1 hour
+
+async def iter_delivery_status_hashes() -> AsyncIterator[Tuple[int, List[int]]]:
+    """Yield each subscription with a status hash and the delivery ids it holds"""
+    async for key in redis_client.scan_iter(match="delivery_status:*"):
+        subscription_id = int(key.rsplit(b":", 1)[1])
+        delivery_ids = [int(delivery_id) for delivery_id in await redis_client.hkeys(key)]
+        yield subscription_id, delivery_ids
+
+async def delete_delivery_statuses(subscription_id: int, delivery_ids: List[int]) -> None:
+    """Remove deliveries from the subscription's status hash"""
+    if delivery_ids:
+        await redis_client.hdel(f"delivery_status:{subscription_id}", *delivery_ids)
+
+async def enqueue_deliveries(delivery_ids: List[int]) -> None:
+    """Add deliveries to the delivery stream in a single round trip"""
+    async with cache_pipeline() as pipeline:
+        for delivery_id in delivery_ids:
+            pipeline.xadd(
+                DELIVERY_STREAM,
+                {"id": delivery_id},
+                maxlen=DELIVERY_STREAM_MAXLEN,
+                approximate=True
+            )
+
+async def create_delivery_group() -> None:
+    """Create the consumer group (and the stream) if they do not exist yet"""
+    try:
+        await redis_client.xgroup_create(DELIVERY_STREAM, DELIVERY_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+def _stream_entries(messages: list) -> List[Tuple[bytes, int]]:
+    # Deleted entries come back with no fields; they only need acking
+    return [
+        (message_id, int(fields[b"id"]) if fields else None)
+        for message_id, fields in messages
+    ]
+
+async def read_deliveries(consumer: str, count: int, block: int) -> List[Tuple[bytes, int, int]]:
+    """Read up to count new deliveries for consumer, waiting up to block ms
+
+    Each entry is (message_id, delivery_id, times_delivered); new entries
+    have been delivered once.
+    """
+    response = await redis_client.xreadgroup(
+        DELIVERY_GROUP, consumer, {DELIVERY_STREAM: ">"}, count=count, block=block
+    )
+    if not response:
+        return []
+    _, messages = response[0]
+    return [(message_id, delivery_id, 1) for message_id, delivery_id in _stream_entries(messages)]
+
+async def claim_stale_deliveries(consumer: str, count: int, min_idle_ms: int) -> List[Tuple[bytes, int, int]]:
+    """Take over deliveries left unacknowledged by a consumer that died mid-batch
+
+    Entries are returned like read_deliveries, with how many times each has
+    been delivered so far, so entries that keep failing can be given up on.
+    """
+    response = await redis_client.xautoclaim(
+        DELIVERY_STREAM, DELIVERY_GROUP, consumer, min_idle_ms, count=count
+    )
+    entries = _stream_entries(response[1])
+    if not entries:
+        return []
+
+    async with redis_client.pipeline(transaction=False) as pipeline:
+        for message_id, _ in entries:
+            pipeline.xpending_range(
+                DELIVERY_STREAM, DELIVERY_GROUP, min=message_id, max=message_id, count=1
+            )
+        pending = await pipeline.execute()
+    return [
+        (message_id, delivery_id, info[0]["times_delivered"] if info else 1)
+        for (message_id, delivery_id), info in zip(entries, pending)
+    ]
+
+async def ack_deliveries(message_ids: List[bytes]) -> None:
+    """Acknowledge processed deliveries and drop them from the stream"""
+    if message_ids:
+        async with cache_pipeline() as pipeline:
+            pipeline.xack(DELIVERY_STREAM, DELIVERY_GROUP, *message_ids)
+            pipeline.xdel(DELIVERY_STREAM, *message_ids)
@@ -0,0 +1,86 @@
+# Import required modules
+from app.config import get_settings
+from app.cache import (
+    create_delivery_group,
+    read_deliveries,
+    claim_stale_deliveries,
+    ack_deliveries,
+    DELIVERY_STALE_MS
+)
+from app.worker import (
+    deliver_batch,
+    dead_letter_deliveries,
+    publish_delivery_statuses,
+    close_http_client
+)
+from redis.exceptions import RedisError
+import asyncio
+import logging
+import os
+import socket
+
+# Load application settings
+settings = get_settings()
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# How long a read waits for new deliveries before checking for stale ones
+READ_BLOCK_MS = 500
+
+# Stream entries delivered more times than this are given up on, so a batch
+# that keeps failing cannot be re-sent forever
+MAX_ENTRY_DELIVERIES = 3
+
+# Deliver the deliveries in a batch of stream entries, then acknowledge them.
+# Entries are acked as soon as deliver_batch commits, before statuses are
+# published, so a failed publish cannot leave sent deliveries pending. A
+# batch that fails before committing stays pending and is claimed again
+# once it goes stale.
+async def process_entries(entries: list) -> None:
+    dead_ids = [
+        delivery_id for _, delivery_id, times_delivered in entries
+        if delivery_id is not None and times_delivered > MAX_ENTRY_DELIVERIES
+    ]
+    delivery_ids = [
+        delivery_id for _, delivery_id, times_delivered in entries
+        if delivery_id is not None and times_delivered <= MAX_ENTRY_DELIVERIES
+    ]
+    if dead_ids:
+        await dead_letter_deliveries(dead_ids)
+    statuses = await deliver_batch(delivery_ids) if delivery_ids else []
+    await ack_deliveries([message_id for message_id, _, _ in entries])
+    await publish_delivery_statuses(statuses)
+
+# Read deliveries from the stream in batches until cancelled
+async def consume(consumer: str) -> None:
+    await create_delivery_group()
+    logger.info("Consumer %s reading from the delivery stream", consumer)
+    while True:
+        try:
+            entries = await claim_stale_deliveries(
+                consumer, settings.DELIVERY_BATCH_SIZE, DELIVERY_STALE_MS
+            )
+            if not entries:
+                entries = await read_deliveries(
+                    consumer, settings.DELIVERY_BATCH_SIZE, READ_BLOCK_MS
+                )
+            if entries:
+                await process_entries(entries)
+        except RedisError as e:
+            logger.error("Delivery stream unavailable: %s", e)
+            await asyncio.sleep(1)
+        except Exception:
+            logger.exception("Failed to process delivery batch")
+            await asyncio.sleep(1)
+
+async def main() -> None:
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    try:
+        await consume(consumer)
+    finally:
+        await close_http_client()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=settings.LOG_LEVEL)
+    asyncio.run(main())
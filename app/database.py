@@ -2,8 +2,12 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import select, insert, update, func, bindparam, text, Interval
 from app.config import get_settings
+from app.models import WebhookDelivery, DeliveryAttempt, DeliveryStatus, AWAITING_DELIVERY
 from psycopg2_pool import PoolError
+from typing import List
+import orjson
 
 # Load application settings
 settings = get_settings()
@@ -14,13 +18,20 @@ engine = create_async_engine(
     settings.DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://'),
     # Configure connection pool settings
     poolclass=AsyncAdaptedQueuePool,
-    pool_size=5,           # Maximum number of connections in pool
-    max_overflow=10,       # Maximum number of connections that can be created above pool_size
-    pool_timeout=30,       # Timeout for getting a connection from pool
+    pool_size=settings.DB_POOL_SIZE,         # Maximum number of connections in pool
+    max_overflow=settings.DB_MAX_OVERFLOW,   # Maximum number of connections that can be created above pool_size
+    pool_timeout=10,       # Fail fast when the pool is exhausted instead of queueing requests
     pool_pre_ping=True,    # Enable connection health checks
     pool_recycle=1800,     # Recycle connections after 30 minutes
+    # Encode/decode JSONB with orjson; SQLAlchemy's asyncpg dialect already
+    # registers a binary JSONB codec that calls these
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
     # Configure PostgreSQL server settings
     connect_args={
+        # Keep more prepared statements per connection to avoid re-PREPARE
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,  # SQLAlchemy adapter cache
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,           # asyncpg cache
         "server_settings": {
             "application_name": "webhook_service",
             "statement_timeout": "30000",  # 30 seconds
@@ -55,4 +66,91 @@ async def get_db():
             await session.rollback()  # Rollback on other errors
             raise e
         finally:
-            await session.close()  # Always close session 
\ No newline at end of file
+            await session.close()  # Always close session 
+
+# Minimum batch size at which delivery attempts are written with COPY; tied to
+# the delivery batch size so any batch at least half full takes the COPY path
+COPY_THRESHOLD = max(1, settings.DELIVERY_BATCH_SIZE // 2)
+
+# Columns written for each delivery attempt, in COPY record order
+ATTEMPT_COLUMNS = ["delivery_id", "attempt_number", "status_code", "response_body", "error_message"]
+
+# Insert delivery attempts as plain dicts with a Core executemany, switching
+# to COPY for large batches to skip per-row INSERT parsing and planning
+async def bulk_insert_attempts(session: AsyncSession, attempts: List[dict]) -> None:
+    if not attempts:
+        return
+    if len(attempts) < COPY_THRESHOLD:
+        await session.execute(insert(DeliveryAttempt.__table__), attempts)
+        return
+
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "delivery_attempts",
+        records=[
+            tuple(attempt[column] for column in ATTEMPT_COLUMNS)
+            for attempt in attempts
+        ],
+        columns=ATTEMPT_COLUMNS
+    )
+
+# Core UPDATE for a delivery's state after an attempt. attempt_count is
+# incremented server-side, so no prior read of the row is needed, and both
+# timestamps come from the database clock so retry scheduling never drifts
+# from the now() that claim_due_deliveries compares against. A NULL
+# retry_delay leaves next_retry_at NULL. Bind names differ from column
+# names, which SQLAlchemy reserves in UPDATE ... VALUES.
+UPDATE_DELIVERY_STATE = (
+    update(WebhookDelivery.__table__)
+    .where(WebhookDelivery.__table__.c.id == bindparam("delivery_id"))
+    .values(
+        status=bindparam("new_status", type_=WebhookDelivery.__table__.c.status.type),
+        attempt_count=WebhookDelivery.__table__.c.attempt_count + 1,
+        last_attempt_at=func.now(),
+        next_retry_at=func.now() + bindparam("retry_delay", type_=Interval)
+    )
+)
+
+# Write the state of every delivery in a batch as a single executemany
+async def update_delivery_states(session: AsyncSession, states: List[dict]) -> None:
+    if states:
+        await session.execute(UPDATE_DELIVERY_STATE, states)
+
+# Claim a batch of deliveries whose retry is due. Rows are locked with
+# FOR UPDATE SKIP LOCKED so concurrent workers never wait on or double-claim
+# the same rows, and next_retry_at is cleared so the claimed rows are due
+# for the consumer but no longer match this query. The caller must queue
+# the ids before committing, so a failed enqueue rolls the claim back.
+async def claim_due_deliveries(session: AsyncSession, batch: int = 100) -> List[int]:
+    due = (
+        select(WebhookDelivery.id)
+        .where(
+            text(AWAITING_DELIVERY),
+            WebhookDelivery.next_retry_at <= func.now()
+        )
+        .order_by(WebhookDelivery.next_retry_at)
+        .limit(batch)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(WebhookDelivery)
+        .where(WebhookDelivery.id.in_(due))
+        .values(next_retry_at=None)
+        .returning(WebhookDelivery.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().all()
+
+# Mark deliveries that can no longer be processed as failed, e.g. ones whose
+# stream entry keeps failing. Deliveries already finished are left alone.
+async def fail_deliveries(session: AsyncSession, delivery_ids: List[int]) -> List[int]:
+    result = await session.execute(
+        update(WebhookDelivery)
+        .where(WebhookDelivery.id.in_(delivery_ids), text(AWAITING_DELIVERY))
+        .values(status=DeliveryStatus.FAILED, next_retry_at=None)
+        .returning(WebhookDelivery.id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalars().all()
@@ -1,31 +1,116 @@
 # Import required FastAPI and database components
 from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, bindparam, func
 from typing import List
-import json
-from datetime import datetime
+from contextlib import asynccontextmanager
+import asyncio
+from itertools import groupby
+import orjson
+from datetime import timedelta
 
 # Import local modules
-from app.database import get_db
+from app.database import AsyncSessionLocal, get_db
 from app.models import Subscription, WebhookDelivery, DeliveryAttempt, DeliveryStatus
 from app.schemas import (
     SubscriptionCreate,
     SubscriptionResponse,
     WebhookPayload,
-    DeliveryStatusResponse,
-    DeliveryAttemptResponse
+    DeliveryStatusResponse
 )
-from app.worker import deliver_webhook, cleanup_old_logs
-from app.cache import set_subscription_in_cache, delete_subscription_from_cache
+from app.cache import (
+    cache_pipeline,
+    set_subscription_in_cache,
+    delete_subscription_from_cache,
+    get_or_set_subscription,
+    debounce_key,
+    reserve_debounced_delivery,
+    set_debounced_delivery,
+    release_debounced_delivery,
+    enqueue_deliveries,
+    DELIVERY_STALE_MS,
+    publish_subscription_invalidation,
+    listen_for_subscription_invalidations
+)
+from app.middleware import ResponseCacheMiddleware, cache_policy, invalidate_cached_response
+from app.config import get_settings
+
+settings = get_settings()
+
+# Keep the process-local subscription cache coherent for the app's lifetime
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    listener = asyncio.create_task(listen_for_subscription_invalidations())
+    yield
+    listener.cancel()
 
 # Initialize FastAPI application with metadata
 app = FastAPI(
     title="Webhook Delivery Service",
     description="A robust webhook delivery service with retry mechanism and logging",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# Serve GET routes registered with cache_policy from Redis
+app.add_middleware(ResponseCacheMiddleware)
+
+# Statements built once at import so handlers skip expression construction and
+# hit SQLAlchemy's compiled cache directly; values are passed as bind params
+SELECT_SUBSCRIPTIONS = select(Subscription).execution_options(yield_per=500)
+SELECT_SUBSCRIPTION_BY_ID = select(Subscription).where(Subscription.id == bindparam("sid"))
+SELECT_DELIVERY_BY_ID = select(WebhookDelivery).where(WebhookDelivery.id == bindparam("did"))
+SELECT_ATTEMPTS_BY_DELIVERY = (
+    select(DeliveryAttempt)
+    .where(DeliveryAttempt.delivery_id == bindparam("did"))
+    .order_by(DeliveryAttempt.attempt_number)
+)
+SELECT_RECENT_DELIVERIES = (
+    select(WebhookDelivery)
+    .where(WebhookDelivery.subscription_id == bindparam("sid"))
+    .order_by(WebhookDelivery.created_at.desc())
+    .limit(bindparam("limit"))
+)
+SELECT_ATTEMPTS_BY_DELIVERIES = (
+    select(DeliveryAttempt)
+    .where(DeliveryAttempt.delivery_id.in_(bindparam("dids", expanding=True)))
+    .order_by(DeliveryAttempt.delivery_id, DeliveryAttempt.attempt_number)
+)
+
+# Serialize a subscription for the cache; the worker reads target_url and
+# secret_key, the remaining fields let GET /subscriptions/{id} skip the database
+def subscription_cache_data(subscription: Subscription) -> dict:
+    return {
+        "id": subscription.id,
+        "name": subscription.name,
+        "target_url": subscription.target_url,
+        "secret_key": subscription.secret_key,
+        "created_at": subscription.created_at.isoformat() if subscription.created_at else None,
+        "updated_at": subscription.updated_at.isoformat() if subscription.updated_at else None
+    }
+
+# Format a delivery and its ordered attempts for DeliveryStatusResponse
+def delivery_status_data(delivery: WebhookDelivery, attempts: List[DeliveryAttempt]) -> dict:
+    return {
+        "delivery_id": delivery.id,
+        "status": delivery.status.value,
+        "attempt_count": delivery.attempt_count,
+        "last_attempt_at": delivery.last_attempt_at,
+        "next_retry_at": delivery.next_retry_at,
+        "attempts": [
+            {
+                "attempt_number": attempt.attempt_number,
+                "status_code": attempt.status_code,
+                "response_body": attempt.response_body,
+                "error_message": attempt.error_message,
+                "created_at": attempt.created_at
+            }
+            for attempt in attempts
+        ]
+    }
+
 # Create a new subscription
 @app.post("/subscriptions/", response_model=SubscriptionResponse, status_code=status.HTTP_201_CREATED)
 async def create_subscription(
@@ -35,7 +120,7 @@ async def create_subscription(
     # Create new subscription record
     db_subscription = Subscription(
         name=subscription.name,
-        target_url=subscription.target_url,
+        target_url=str(subscription.target_url),
         secret_key=subscription.secret_key
     )
     db.add(db_subscription)
@@ -43,29 +128,50 @@ async def create_subscription(
     await db.refresh(db_subscription)
     
     # Cache subscription details for faster access
-    set_subscription_in_cache(
+    await set_subscription_in_cache(
         db_subscription.id,
-        {
-            "target_url": db_subscription.target_url,
-            "secret_key": db_subscription.secret_key
-        }
+        subscription_cache_data(db_subscription)
     )
     
     return db_subscription
 
+# Encode subscriptions as a JSON array, one chunk per batch of rows fetched
+# from a server-side cursor, so the full result set is never held in memory.
+# The generator opens its own session because it runs after the handler returns.
+async def stream_subscriptions():
+    async with AsyncSessionLocal() as session:
+        result = await session.stream_scalars(SELECT_SUBSCRIPTIONS)
+        yield b"["
+        separator = b""
+        async for partition in result.partitions():
+            yield separator + b",".join(
+                orjson.dumps(SubscriptionResponse.model_validate(subscription).model_dump(mode="json"))
+                for subscription in partition
+            )
+            separator = b","
+        yield b"]"
+
 # List all subscriptions
 @app.get("/subscriptions/", response_model=List[SubscriptionResponse])
-async def list_subscriptions(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Subscription))
-    return result.scalars().all()
+async def list_subscriptions():
+    return StreamingResponse(stream_subscriptions(), media_type="application/json")
 
 # Get a specific subscription by ID
-@app.get("/subscriptions/{subscription_id}", response_model=SubscriptionResponse)
+@app.get(
+    "/subscriptions/{subscription_id}",
+    response_model=SubscriptionResponse,
+    dependencies=[Depends(cache_policy("long"))]
+)
 async def get_subscription(subscription_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Subscription).where(Subscription.id == subscription_id)
-    )
-    subscription = result.scalar_one_or_none()
+    async def load_subscription():
+        result = await db.execute(
+            SELECT_SUBSCRIPTION_BY_ID, {"sid": subscription_id}
+        )
+        subscription = result.scalar_one_or_none()
+        return subscription_cache_data(subscription) if subscription else None
+
+    # Read through the cache so only one request repopulates it on a miss
+    subscription = await get_or_set_subscription(subscription_id, load_subscription)
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
     return subscription
@@ -79,7 +185,7 @@ async def update_subscription(
 ):
     # Find the subscription to update
     result = await db.execute(
-        select(Subscription).where(Subscription.id == subscription_id)
+        SELECT_SUBSCRIPTION_BY_ID, {"sid": subscription_id}
     )
     db_subscription = result.scalar_one_or_none()
     if not db_subscription:
@@ -87,20 +193,22 @@ async def update_subscription(
     
     # Update subscription details
     db_subscription.name = subscription.name
-    db_subscription.target_url = subscription.target_url
+    db_subscription.target_url = str(subscription.target_url)
     db_subscription.secret_key = subscription.secret_key
     
     await db.commit()
     await db.refresh(db_subscription)
     
-    # Update cache with new subscription details
-    set_subscription_in_cache(
-        db_subscription.id,
-        {
-            "target_url": db_subscription.target_url,
-            "secret_key": db_subscription.secret_key
-        }
-    )
+    # Update cache with new subscription details, evict local tiers and
+    # cached responses in one round trip
+    async with cache_pipeline() as pipeline:
+        await set_subscription_in_cache(
+            db_subscription.id,
+            subscription_cache_data(db_subscription),
+            pipeline
+        )
+        await publish_subscription_invalidation(subscription_id, pipeline)
+        await invalidate_cached_response(f"/subscriptions/{subscription_id}", pipeline)
     
     return db_subscription
 
@@ -109,7 +217,7 @@ async def update_subscription(
 async def delete_subscription(subscription_id: int, db: AsyncSession = Depends(get_db)):
     # Find the subscription to delete
     result = await db.execute(
-        select(Subscription).where(Subscription.id == subscription_id)
+        SELECT_SUBSCRIPTION_BY_ID, {"sid": subscription_id}
     )
     subscription = result.scalar_one_or_none()
     if not subscription:
@@ -119,8 +227,11 @@ async def delete_subscription(subscription_id: int, db: AsyncSession = Depends(g
     await db.delete(subscription)
     await db.commit()
     
-    # Remove subscription from cache
-    delete_subscription_from_cache(subscription_id)
+    # Remove subscription and its cached responses from cache in one round trip
+    async with cache_pipeline() as pipeline:
+        await delete_subscription_from_cache(subscription_id, pipeline)
+        await publish_subscription_invalidation(subscription_id, pipeline)
+        await invalidate_cached_response(f"/subscriptions/{subscription_id}", pipeline)
 
 # Ingest a new webhook
 @app.post("/ingest/{subscription_id}", status_code=status.HTTP_202_ACCEPTED)
@@ -131,33 +242,65 @@ async def ingest_webhook(
 ):
     # Verify subscription exists
     result = await db.execute(
-        select(Subscription).where(Subscription.id == subscription_id)
+        SELECT_SUBSCRIPTION_BY_ID, {"sid": subscription_id}
     )
     subscription = result.scalar_one_or_none()
     if not subscription:
         raise HTTPException(status_code=404, detail="Subscription not found")
     
-    # Create delivery record for the webhook
+    # Coalesce identical events fired repeatedly within the debounce window
+    # into the delivery that is already scheduled. The key is reserved
+    # atomically before inserting, so only one concurrent caller creates it.
+    debounce = None
+    if settings.DEBOUNCE_WINDOW_SECONDS > 0:
+        debounce = debounce_key(subscription_id, payload.event_type, payload.data)
+        existing_delivery_id = await reserve_debounced_delivery(
+            debounce, settings.DEBOUNCE_WINDOW_SECONDS
+        )
+        if existing_delivery_id is not None:
+            return {"delivery_id": existing_delivery_id, "status": "accepted"}
+    
+    # Create delivery record for the webhook, keeping the encoded body so
+    # the worker can send it without decoding and re-encoding the payload
+    payload_data = payload.model_dump(mode="json")
+    # next_retry_at is a fallback: if the stream entry is lost (failed
+    # enqueue, trimmed stream) retry_due_deliveries picks the delivery up
     delivery = WebhookDelivery(
         subscription_id=subscription_id,
-        payload=payload.dict(),
-        status=DeliveryStatus.PENDING
+        payload=payload_data,
+        payload_raw=orjson.dumps(payload_data),
+        status=DeliveryStatus.PENDING,
+        next_retry_at=func.now() + timedelta(milliseconds=DELIVERY_STALE_MS)
     )
-    db.add(delivery)
-    await db.commit()
-    await db.refresh(delivery)
+    try:
+        db.add(delivery)
+        await db.commit()
+        await db.refresh(delivery)
+        
+        # Hand the delivery to the consumer group; consumers read it in batches
+        await enqueue_deliveries([delivery.id])
+    except BaseException:
+        # Let waiting duplicates create the delivery instead
+        if debounce:
+            await release_debounced_delivery(debounce)
+        raise
     
-    # Queue the delivery task for background processing
-    deliver_webhook.delay(delivery.id)
+    # Only point duplicates at the delivery once it is queued
+    if debounce:
+        await set_debounced_delivery(debounce, delivery.id, settings.DEBOUNCE_WINDOW_SECONDS)
     
     return {"delivery_id": delivery.id, "status": "accepted"}
 
 # Get delivery status for a specific webhook
-@app.get("/deliveries/{delivery_id}", response_model=DeliveryStatusResponse)
+@app.get(
+    "/deliveries/{delivery_id}",
+    response_model=DeliveryStatusResponse,
+    dependencies=[Depends(cache_policy("short"))]
+)
 async def get_delivery_status(delivery_id: int, db: AsyncSession = Depends(get_db)):
     # Get delivery details
     result = await db.execute(
-        select(WebhookDelivery).where(WebhookDelivery.id == delivery_id)
+        SELECT_DELIVERY_BY_ID, {"did": delivery_id}
     )
     delivery = result.scalar_one_or_none()
     if not delivery:
@@ -165,30 +308,12 @@ async def get_delivery_status(delivery_id: int, db: AsyncSession = Depends(get_d
     
     # Get all delivery attempts
     result = await db.execute(
-        select(DeliveryAttempt)
-        .where(DeliveryAttempt.delivery_id == delivery_id)
-        .order_by(DeliveryAttempt.attempt_number)
+        SELECT_ATTEMPTS_BY_DELIVERY, {"did": delivery_id}
     )
     attempts = result.scalars().all()
     
     # Format response with delivery status and attempts
-    return {
-        "delivery_id": delivery.id,
-        "status": delivery.status.value,
-        "attempt_count": delivery.attempt_count,
-        "last_attempt_at": delivery.last_attempt_at,
-        "next_retry_at": delivery.next_retry_at,
-        "attempts": [
-            {
-                "attempt_number": attempt.attempt_number,
-                "status_code": attempt.status_code,
-                "response_body": attempt.response_body,
-                "error_message": attempt.error_message,
-                "created_at": attempt.created_at
-            }
-            for attempt in attempts
-        ]
-    }
+    return delivery_status_data(delivery, attempts)
 
 # List all deliveries for a subscription
 @app.get("/subscriptions/{subscription_id}/deliveries", response_model=List[DeliveryStatusResponse])
@@ -199,40 +324,24 @@ async def list_subscription_deliveries(
 ):
     # Get recent deliveries for the subscription
     result = await db.execute(
-        select(WebhookDelivery)
-        .where(WebhookDelivery.subscription_id == subscription_id)
-        .order_by(WebhookDelivery.created_at.desc())
-        .limit(limit)
+        SELECT_RECENT_DELIVERIES, {"sid": subscription_id, "limit": limit}
     )
     deliveries = result.scalars().all()
+    if not deliveries:
+        return []
     
-    # Get delivery attempts for each delivery
-    result = []
-    for delivery in deliveries:
-        attempts_result = await db.execute(
-            select(DeliveryAttempt)
-            .where(DeliveryAttempt.delivery_id == delivery.id)
-            .order_by(DeliveryAttempt.attempt_number)
-        )
-        attempts = attempts_result.scalars().all()
-        
-        # Format response for each delivery
-        result.append({
-            "delivery_id": delivery.id,
-            "status": delivery.status.value,
-            "attempt_count": delivery.attempt_count,
-            "last_attempt_at": delivery.last_attempt_at,
-            "next_retry_at": delivery.next_retry_at,
-            "attempts": [
-                {
-                    "attempt_number": attempt.attempt_number,
-                    "status_code": attempt.status_code,
-                    "response_body": attempt.response_body,
-                    "error_message": attempt.error_message,
-                    "created_at": attempt.created_at
-                }
-                for attempt in attempts
-            ]
-        })
-    
-    return result 
\ No newline at end of file
+    # Get attempts for all deliveries in one query and group them by delivery
+    result = await db.execute(
+        SELECT_ATTEMPTS_BY_DELIVERIES,
+        {"dids": [delivery.id for delivery in deliveries]}
+    )
+    attempts_by_delivery = {
+        delivery_id: list(attempts)
+        for delivery_id, attempts in groupby(result.scalars().all(), key=lambda a: a.delivery_id)
+    }
+    
+    # Format response for each delivery
+    return [
+        delivery_status_data(delivery, attempts_by_delivery.get(delivery.id, []))
+        for delivery in deliveries
+    ]
@@ -0,0 +1,147 @@
+# Import required modules
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.routing import Match
+from redis.asyncio.client import Pipeline
+from redis.exceptions import RedisError
+from app.cache import redis_client
+from typing import Optional
+import hashlib
+import logging
+import orjson
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Fresh TTL in seconds for each response cache policy
+CACHE_POLICIES = {
+    "short": 5,    # Data that changes on retry, e.g. delivery status
+    "normal": 30,
+    "long": 60,    # Data that changes rarely, e.g. subscriptions
+}
+
+# How long the last good response is kept to serve while the handler is failing
+STALE_TTL = 3600
+
+# Mark a route as cacheable, e.g. dependencies=[Depends(cache_policy("short"))]
+def cache_policy(name: str):
+    ttl = CACHE_POLICIES[name]
+
+    async def response_cache_policy() -> None:
+        return None
+
+    response_cache_policy.cache_ttl = ttl
+    return response_cache_policy
+
+# Build the fresh and stale cache keys for a request path and query string
+def response_cache_keys(path: str, query: str = "") -> tuple:
+    digest = hashlib.sha1(f"{path}?{query}".encode()).hexdigest()
+    return f"cache:resp:{digest}", f"cache:resp:stale:{digest}"
+
+# Set of every cache key stored for a path, across all its query strings
+def response_variants_key(path: str) -> str:
+    return f"cache:resp:variants:{hashlib.sha1(path.encode()).hexdigest()}"
+
+# Drop cached responses for a path, with any query string, after the
+# underlying data changes. The variant keys are read first; the delete is
+# queued on pipeline if given.
+async def invalidate_cached_response(path: str, pipeline: Optional[Pipeline] = None) -> None:
+    variants_key = response_variants_key(path)
+    keys = await redis_client.smembers(variants_key)
+    client = pipeline if pipeline is not None else redis_client
+    await client.delete(variants_key, *response_cache_keys(path), *keys)
+
+# Serve cached GET responses for routes registered with cache_policy
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        if request.method != "GET":
+            return await call_next(request)
+
+        ttl = self._route_ttl(request)
+        if ttl is None:
+            return await call_next(request)
+
+        key, stale_key = response_cache_keys(request.url.path, request.url.query)
+        cached = await self._get(key)
+        if cached:
+            return self._build_response(cached, "HIT")
+
+        try:
+            response = await call_next(request)
+        except Exception:
+            # Fall back to the last good response, e.g. during a database outage
+            stale = await self._get(stale_key)
+            if stale:
+                logger.warning("Serving stale response for %s", request.url.path)
+                return self._build_response(stale, "STALE")
+            raise
+
+        if response.status_code >= 500:
+            stale = await self._get(stale_key)
+            if stale:
+                logger.warning("Serving stale response for %s", request.url.path)
+                return self._build_response(stale, "STALE")
+        if response.status_code != 200:
+            return response
+
+        # Buffer the body so it can be both cached and returned
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name != "content-length"
+        }
+        entry = orjson.dumps({
+            "status_code": response.status_code,
+            "headers": headers,
+            "body": body.decode()
+        })
+        try:
+            async with redis_client.pipeline(transaction=False) as pipeline:
+                pipeline.setex(key, ttl, entry)
+                pipeline.setex(stale_key, STALE_TTL, entry)
+                # Track the keys so invalidate_cached_response finds them
+                variants_key = response_variants_key(request.url.path)
+                pipeline.sadd(variants_key, key, stale_key)
+                pipeline.expire(variants_key, STALE_TTL)
+                await pipeline.execute()
+        except RedisError as e:
+            logger.warning("Failed to cache response for %s: %s", request.url.path, e)
+
+        return Response(
+            content=body,
+            status_code=response.status_code,
+            headers={**headers, "X-Cache": "MISS"}
+        )
+
+    # Find the matched route's cache policy TTL, if it has one
+    @staticmethod
+    def _route_ttl(request: Request) -> Optional[int]:
+        for route in request.app.router.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                for dependency in getattr(route, "dependencies", []):
+                    ttl = getattr(dependency.dependency, "cache_ttl", None)
+                    if ttl is not None:
+                        return ttl
+                return None
+        return None
+
+    # Read a cache entry, treating Redis errors as a miss
+    @staticmethod
+    async def _get(key: str) -> Optional[bytes]:
+        try:
+            return await redis_client.get(key)
+        except RedisError as e:
+            logger.warning("Response cache unavailable: %s", e)
+            return None
+
+    @staticmethod
+    def _build_response(entry: bytes, cache_status: str) -> Response:
+        data = orjson.loads(entry)
+        return Response(
+            content=data["body"].encode(),
+            status_code=data["status_code"],
+            headers={**data["headers"], "X-Cache": cache_status}
+        )
@@ -1,5 +1,5 @@
 # Import required SQLAlchemy components
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Index, text, event
+from sqlalchemy import Column, BigInteger, Integer, String, LargeBinary, DateTime, ForeignKey, Enum, Index, Computed, text
 from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
@@ -16,18 +16,25 @@ class DeliveryStatus(enum.Enum):
     FAILED = "failed"      # Webhook delivery failed after all retries
     RETRYING = "retrying"  # Webhook delivery failed, waiting for retry
 
+# Deliveries still waiting to be sent, as a literal predicate so queries using
+# it match the partial index on next_retry_at even under a generic prepared plan
+AWAITING_DELIVERY = "status IN ('pending', 'retrying')"
+
 # Subscription model for webhook endpoints
 class Subscription(Base):
     __tablename__ = "subscriptions"
 
     # Primary key and basic fields
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(BigInteger, primary_key=True)
     name = Column(String, nullable=False)           # Subscription name
     target_url = Column(String, nullable=False)     # Webhook endpoint URL
     secret_key = Column(String, nullable=True)      # Secret key for webhook verification
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # Creation timestamp
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())        # Last update timestamp
-    search_vector = Column(TSVECTOR)                # Full-text search vector
+    search_vector = Column(                         # Full-text search vector maintained by PostgreSQL
+        TSVECTOR,
+        Computed("to_tsvector('english', name)", persisted=True)
+    )
 
     # Define relationship with deliveries
     deliveries = relationship("WebhookDelivery", back_populates="subscription", cascade="all, delete-orphan")
@@ -42,27 +49,28 @@ class Subscription(Base):
         Index('ix_subscriptions_search_vector', 'search_vector', postgresql_using='gin'),
     )
 
-# Event listener to update search vector before insert/update
-@event.listens_for(Subscription, 'before_insert')
-@event.listens_for(Subscription, 'before_update')
-def update_search_vector(mapper, connection, target):
-    target.search_vector = func.to_tsvector('english', target.name)
-
 # Webhook delivery model
 class WebhookDelivery(Base):
     __tablename__ = "webhook_deliveries"
 
     # Primary key and basic fields
-    id = Column(Integer, primary_key=True, index=True)
-    subscription_id = Column(Integer, ForeignKey("subscriptions.id", ondelete="CASCADE"))  # Related subscription
+    id = Column(BigInteger, primary_key=True)
+    subscription_id = Column(BigInteger, ForeignKey("subscriptions.id", ondelete="CASCADE"))  # Related subscription
     payload = Column(JSONB, nullable=False)         # Webhook payload data
-    status = Column(Enum(DeliveryStatus, name='deliverystatus'), default=DeliveryStatus.PENDING)  # Delivery status
+    payload_raw = Column(LargeBinary, nullable=True)  # Payload encoded once at ingest, sent as-is on every attempt
+    status = Column(                                # Delivery status, stored as the lowercase enum values
+        Enum(DeliveryStatus, name='deliverystatus', values_callable=lambda e: [m.value for m in e]),
+        default=DeliveryStatus.PENDING
+    )
     attempt_count = Column(Integer, default=0)      # Number of delivery attempts
     last_attempt_at = Column(DateTime(timezone=True))  # Timestamp of last attempt
     next_retry_at = Column(DateTime(timezone=True))    # Timestamp for next retry
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # Creation timestamp
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())        # Last update timestamp
-    payload_search = Column(TSVECTOR)               # Full-text search vector for payload
+    payload_search = Column(                        # Full-text search vector for payload maintained by PostgreSQL
+        TSVECTOR,
+        Computed("to_tsvector('english', jsonb_path_query_array(payload, '$.*'))", persisted=True)
+    )
 
     # Define relationships
     subscription = relationship("Subscription", back_populates="deliveries")
@@ -74,27 +82,25 @@ class WebhookDelivery(Base):
         Index('ix_webhook_deliveries_status', 'status'),
         # Index for created_at for efficient time-based queries
         Index('ix_webhook_deliveries_created_at', 'created_at'),
-        # Index for subscription_id for efficient filtering
-        Index('ix_webhook_deliveries_subscription_id', 'subscription_id'),
-        # Index for next_retry_at for efficient retry scheduling
-        Index('ix_webhook_deliveries_next_retry_at', 'next_retry_at'),
+        # Composite index for listing a subscription's most recent deliveries
+        Index('ix_webhook_deliveries_subscription_id_created_at', 'subscription_id', text('created_at DESC')),
+        # Partial index for next_retry_at covering only deliveries awaiting retry
+        Index(
+            'ix_webhook_deliveries_next_retry_at_due',
+            'next_retry_at',
+            postgresql_where=text(AWAITING_DELIVERY)
+        ),
         # GIN index for full-text search on payload
         Index('ix_webhook_deliveries_payload_search', 'payload_search', postgresql_using='gin'),
     )
 
-# Event listener to update payload search vector before insert/update
-@event.listens_for(WebhookDelivery, 'before_insert')
-@event.listens_for(WebhookDelivery, 'before_update')
-def update_payload_search(mapper, connection, target):
-    target.payload_search = func.to_tsvector('english', func.jsonb_path_query_array(target.payload, '$.*'))
-
 # Delivery attempt model
 class DeliveryAttempt(Base):
     __tablename__ = "delivery_attempts"
 
     # Primary key and basic fields
-    id = Column(Integer, primary_key=True, index=True)
-    delivery_id = Column(Integer, ForeignKey("webhook_deliveries.id", ondelete="CASCADE"))  # Related delivery
+    id = Column(BigInteger, primary_key=True)
+    delivery_id = Column(BigInteger, ForeignKey("webhook_deliveries.id", ondelete="CASCADE"))  # Related delivery
     attempt_number = Column(Integer, nullable=False)  # Sequential attempt number
     status_code = Column(Integer, nullable=True)      # HTTP status code from attempt
     response_body = Column(String, nullable=True)     # Response body from attempt
@@ -106,8 +112,8 @@ class DeliveryAttempt(Base):
 
     # Define PostgreSQL-specific indexes
     __table_args__ = (
-        # Index for delivery_id for efficient filtering
-        Index('ix_delivery_attempts_delivery_id', 'delivery_id'),
+        # Composite index for fetching a delivery's attempts in order
+        Index('ix_delivery_attempts_delivery_id_attempt_number', 'delivery_id', 'attempt_number'),
         # Index for created_at for efficient time-based queries
         Index('ix_delivery_attempts_created_at', 'created_at'),
         # Index for status_code for efficient filtering
@@ -1,8 +1,9 @@
 # Import required Pydantic components
-from pydantic import BaseModel, HttpUrl, Field, validator
+from pydantic import BaseModel, ConfigDict, HttpUrl, Field, field_validator
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
+import orjson
 
 # Define delivery status enum for schema validation
 class DeliveryStatus(str, Enum):
@@ -18,7 +19,8 @@ class SubscriptionBase(BaseModel):
     secret_key: str = Field(..., min_length=32, max_length=64)  # Secret key with length constraints
 
     # Validate secret key format
-    @validator('secret_key')
+    @field_validator('secret_key')
+    @classmethod
     def validate_secret_key(cls, v):
         if not v.isalnum():
             raise ValueError('Secret key must contain only alphanumeric characters')
@@ -30,18 +32,29 @@ class SubscriptionCreate(SubscriptionBase):
 
 # Schema for subscription response
 class SubscriptionResponse(SubscriptionBase):
+    target_url: str      # Stored URL, already validated on input; skips URL re-parsing
     id: int              # Subscription ID
     created_at: datetime # Creation timestamp
-    updated_at: datetime # Last update timestamp
+    updated_at: Optional[datetime] # Last update timestamp, unset until first update
 
-    class Config:
-        orm_mode = True  # Enable ORM mode for SQLAlchemy model conversion
+    model_config = ConfigDict(from_attributes=True)  # Enable attribute access for SQLAlchemy model conversion
 
 # Schema for webhook payload
 class WebhookPayload(BaseModel):
     event_type: str = Field(..., min_length=1, max_length=100)  # Event type with length constraints
     data: Dict[str, Any]                                        # Webhook payload data
-    timestamp: datetime = Field(default_factory=datetime.utcnow)  # Timestamp with default value
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # Timestamp with default value
+
+    # Payloads are encoded with orjson, which only supports 64-bit integers;
+    # reject anything it cannot encode here with a 422 instead of a 500 later
+    @field_validator('data')
+    @classmethod
+    def validate_data_encodable(cls, v):
+        try:
+            orjson.dumps(v)
+        except orjson.JSONEncodeError as e:
+            raise ValueError(f'Payload data cannot be encoded as JSON: {e}')
+        return v
 
 # Schema for delivery attempt response
 class DeliveryAttemptResponse(BaseModel):
@@ -51,8 +64,7 @@ class DeliveryAttemptResponse(BaseModel):
     error_message: Optional[str]           # Error message if attempt failed
     created_at: datetime                   # Creation timestamp
 
-    class Config:
-        orm_mode = True  # Enable ORM mode for SQLAlchemy model conversion
+    model_config = ConfigDict(from_attributes=True)  # Enable attribute access for SQLAlchemy model conversion
 
 # Schema for delivery status response
 class DeliveryStatusResponse(BaseModel):
@@ -63,5 +75,4 @@ class DeliveryStatusResponse(BaseModel):
     next_retry_at: Optional[datetime]      # Timestamp for next retry
     attempts: List[DeliveryAttemptResponse]  # List of delivery attempts
 
-    class Config:
-        orm_mode = True  # Enable ORM mode for SQLAlchemy model conversion 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)  # Enable attribute access for SQLAlchemy model conversion 
\ No newline at end of file
@@ -1,21 +1,40 @@
 # Import required modules
 from celery import Celery
+from celery.utils.time import get_exponential_backoff_interval
 from app.config import get_settings
-from app.database import AsyncSessionLocal
+from app.database import (
+    AsyncSessionLocal,
+    bulk_insert_attempts,
+    update_delivery_states,
+    claim_due_deliveries,
+    fail_deliveries
+)
 from app.models import WebhookDelivery, DeliveryAttempt, DeliveryStatus, Subscription
-from app.cache import get_subscription_from_cache, set_delivery_status
+from app.cache import (
+    cache_pipeline,
+    set_delivery_status,
+    enqueue_deliveries,
+    iter_delivery_status_hashes,
+    delete_delivery_statuses
+)
 import httpx
-import json
-from datetime import datetime, timedelta
+import hmac
+from functools import lru_cache
+from datetime import timedelta
 import logging
 import asyncio
-from sqlalchemy import select
+from sqlalchemy import select, delete, func, cast, or_, Text, Row
 from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
 
 # Load application settings
 settings = get_settings()
 
-# Initialize Celery application
+# Initialize Celery application. Deliveries themselves are read from a Redis
+# stream by app/consumer.py; Celery only runs the periodic tasks below.
+# Tasks are coroutines run on a single persistent event loop by
+# celery-aio-pool (see run.py), which database connections are bound to.
+# Only async tasks may be registered here.
 celery_app = Celery(
     "webhook_worker",
     broker=settings.CELERY_BROKER_URL,
@@ -24,109 +43,292 @@ celery_app = Celery(
 
 # Configure Celery settings
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    # msgpack with zstd compression keeps broker messages small; json is
+    # still accepted for messages queued before the switch
+    task_serializer="msgpack",
+    accept_content=["msgpack", "json"],
+    result_serializer="msgpack",
+    task_compression="zstd",
     timezone="UTC",
     enable_utc=True,
+    # Delivery state lives in Postgres and nothing reads task results, so
+    # skip the result-backend write on every task state change
+    task_ignore_result=True,
 )
 
+# Periodic tasks, run by the beat scheduler
+celery_app.conf.beat_schedule = {
+    "prune-delivery-status": {
+        "task": "app.worker.prune_status_hash",
+        "schedule": 3600.0,  # Every hour
+    },
+    "cleanup-old-logs": {
+        "task": "app.worker.cleanup_old_logs",
+        "schedule": 3600.0,  # Every hour
+    },
+    "retry-due-deliveries": {
+        "task": "app.worker.retry_due_deliveries",
+        "schedule": 5.0,
+    },
+}
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Helper function to get delivery details from database
-async def get_delivery(session: AsyncSession, delivery_id: int) -> WebhookDelivery:
-    result = await session.execute(
-        select(WebhookDelivery).where(WebhookDelivery.id == delivery_id)
-    )
-    return result.scalar_one_or_none()
+# HTTP client shared by every delivery in the consumer process so
+# connections (and TLS sessions) to target hosts are pooled and reused. It
+# is created lazily on first use so it binds to the running event loop.
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            # HTTP/2 multiplexes concurrent deliveries to the same host over
+            # one connection; hosts without it are negotiated down to HTTP/1.1
+            http2=True,
+            limits=httpx.Limits(max_connections=1000, max_keepalive_connections=200),
+            timeout=10.0
+        )
+    return _client
 
-# Helper function to get subscription details from database
-async def get_subscription(session: AsyncSession, subscription_id: int) -> Subscription:
+# Close pooled connections when the consumer exits
+async def close_http_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+# Helper function to load what a batch of deliveries needs to be sent, as
+# plain rows joined with their subscriptions in a single round trip. The
+# pre-encoded payload bytes are sent as-is, so the JSONB payload is never
+# decoded into Python objects; rows from before payload_raw existed are
+# encoded by PostgreSQL instead.
+async def get_deliveries(session: AsyncSession, delivery_ids: List[int]) -> List[Row]:
     result = await session.execute(
-        select(Subscription).where(Subscription.id == subscription_id)
+        select(
+            WebhookDelivery.id,
+            WebhookDelivery.subscription_id,
+            WebhookDelivery.attempt_count,
+            func.coalesce(
+                WebhookDelivery.payload_raw,
+                func.convert_to(cast(WebhookDelivery.payload, Text), "UTF8")
+            ).label("payload_raw"),
+            Subscription.target_url,
+            Subscription.secret_key
+        )
+        .join(Subscription, Subscription.id == WebhookDelivery.subscription_id)
+        .where(WebhookDelivery.id.in_(delivery_ids))
+        .where(WebhookDelivery.status.in_([DeliveryStatus.PENDING, DeliveryStatus.RETRYING]))
+        # Skip retries that are not due yet, e.g. when a stream entry is
+        # redelivered after its attempt was already committed. Pending
+        # deliveries carry a fallback next_retry_at and are always due.
+        .where(or_(
+            WebhookDelivery.status == DeliveryStatus.PENDING,
+            WebhookDelivery.next_retry_at.is_(None),
+            WebhookDelivery.next_retry_at <= func.now()
+        ))
     )
-    return result.scalar_one_or_none()
+    return result.all()
+
+# Encoded HMAC key per subscription secret, so hot subscriptions skip re-encoding
+@lru_cache(maxsize=10_000)
+def signing_key(secret_key: str) -> bytes:
+    return secret_key.encode()
+
+# Hex HMAC-SHA256 of the request body; hmac.digest runs in a single OpenSSL call
+def sign_payload(secret_key: str, body: bytes) -> str:
+    return hmac.digest(signing_key(secret_key), body, "sha256").hex()
+
+# PostgreSQL text columns reject NUL characters, which targets can send back
+def db_text(value: str) -> str:
+    return value.replace("\x00", "")
+
+# Read only the first limit bytes of a response body for the attempt log.
+# Reading stops there; leaving the stream() context then closes the
+# response, dropping the connection rather than draining a body that may
+# never end.
+async def read_body_preview(response: httpx.Response, limit: int) -> str:
+    preview = bytearray()
+    async for chunk in response.aiter_bytes():
+        preview += chunk[:limit - len(preview)]
+        if len(preview) >= limit:
+            break
+    return db_text(preview.decode("utf-8", "replace"))
 
-# Main task for delivering webhooks
-@celery_app.task(bind=True, max_retries=settings.MAX_RETRY_ATTEMPTS)
-async def deliver_webhook(self, delivery_id: int):
+# Raised for responses that should be retried, i.e. any non-2xx status
+class RetryableError(Exception):
+    pass
+
+# Attempt a single delivery; returns the attempt row to insert and the
+# delivery's new state as plain dicts. Does no database I/O, so many can
+# run concurrently.
+async def deliver_one(client: httpx.AsyncClient, delivery: Row) -> Tuple[dict, dict]:
+    attempt = {
+        "delivery_id": delivery.id,
+        "attempt_number": delivery.attempt_count + 1,
+        "status_code": None,
+        "response_body": None,
+        "error_message": None
+    }
+    retryable = False
+    headers = {"Content-Type": "application/json"}
+    if delivery.secret_key:
+        headers["X-Signature"] = sign_payload(delivery.secret_key, delivery.payload_raw)
+    try:
+        # The client timeout applies per network read, so a target trickling
+        # bytes could otherwise hold the attempt (and the batch) for hours
+        async with asyncio.timeout(settings.DELIVERY_TIMEOUT_SECONDS):
+            async with client.stream(
+                "POST",
+                delivery.target_url,
+                content=delivery.payload_raw,
+                headers=headers,
+                timeout=10.0
+            ) as response:
+                attempt["status_code"] = response.status_code
+                attempt["response_body"] = await read_body_preview(response, settings.MAX_RESPONSE_BYTES)
+        if not 200 <= response.status_code < 300:
+            # Status code only: the body preview is already on the attempt
+            raise RetryableError(f"HTTP {response.status_code}")
+    except TimeoutError:
+        logger.error("Delivery %s attempt timed out", delivery.id)
+        attempt["error_message"] = f"Timed out after {settings.DELIVERY_TIMEOUT_SECONDS}s"
+        retryable = True
+    except (httpx.HTTPError, RetryableError) as e:
+        logger.error("Delivery %s attempt failed: %s", delivery.id, e)
+        attempt["error_message"] = db_text(str(e))
+        retryable = True
+    except Exception as e:
+        logger.error("Delivery %s attempt failed permanently: %s", delivery.id, e)
+        attempt["error_message"] = db_text(str(e))
+
+    state = {"delivery_id": delivery.id, "retry_delay": None}
+
+    if attempt["error_message"] is None:
+        # Mark delivery as successful
+        state["new_status"] = DeliveryStatus.SUCCESS
+    elif retryable and attempt["attempt_number"] <= settings.MAX_RETRY_ATTEMPTS:
+        # Schedule retry using Celery's exponential backoff with full jitter,
+        # the same policy as retry_backoff/retry_jitter, so retries against a
+        # failing target spread out instead of arriving together.
+        # retry_due_deliveries picks it up once due.
+        retry_delay = get_exponential_backoff_interval(
+            factor=settings.INITIAL_RETRY_DELAY,
+            retries=attempt["attempt_number"] - 1,
+            maximum=settings.MAX_RETRY_DELAY,
+            full_jitter=True
+        )
+        state["new_status"] = DeliveryStatus.RETRYING
+        state["retry_delay"] = timedelta(seconds=retry_delay)
+    else:
+        # Mark as failed after max retries or a non-retryable error
+        state["new_status"] = DeliveryStatus.FAILED
+
+    return attempt, state
+
+# Deliver a batch of webhooks: load deliveries with their subscriptions,
+# post concurrently, then record all attempts and state changes in one commit.
+# The read and the write use separate sessions so no connection sits idle
+# in a transaction while the requests are in flight.
+# Returns the (subscription_id, delivery_id, status) of each delivery sent,
+# for publish_delivery_statuses once the batch is acknowledged.
+async def deliver_batch(delivery_ids: List[int]) -> List[Tuple[int, int, str]]:
+    async with AsyncSessionLocal() as session:
+        deliveries = await get_deliveries(session, delivery_ids)
+    if not deliveries:
+        return []
+
+    client = get_client()
+    results = await asyncio.gather(*[
+        deliver_one(client, delivery) for delivery in deliveries
+    ])
+
+    results = await record_results(results)
+    return [
+        (delivery.subscription_id, delivery.id, state["new_status"].value)
+        for delivery, (_, state) in zip(deliveries, results)
+        if state is not None
+    ]
+
+# Write a batch's attempts and state changes in one transaction. If that
+# fails, each delivery is retried in its own transaction so one bad row
+# cannot roll back the rest; a delivery that still cannot be written is
+# marked failed and its result replaced with (attempt, None). Raises only
+# if nothing at all could be written, e.g. while the database is down.
+async def record_results(results: List[Tuple[dict, dict]]) -> List[Tuple[dict, Optional[dict]]]:
     async with AsyncSessionLocal() as session:
         try:
-            # Get delivery details from database
-            delivery = await get_delivery(session, delivery_id)
-            if not delivery:
-                logger.error(f"Delivery {delivery_id} not found")
-                return
-
-            # Get subscription details from cache or database
-            subscription_data = get_subscription_from_cache(delivery.subscription_id)
-            if not subscription_data:
-                subscription = await get_subscription(session, delivery.subscription_id)
-                if not subscription:
-                    logger.error(f"Subscription {delivery.subscription_id} not found")
-                    return
-                subscription_data = {
-                    "target_url": subscription.target_url,
-                    "secret_key": subscription.secret_key
-                }
-                set_subscription_in_cache(delivery.subscription_id, subscription_data)
-
-            # Make HTTP request to deliver webhook
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        subscription_data["target_url"],
-                        json=delivery.payload,
-                        timeout=10.0
-                    )
-                    
-                    # Log delivery attempt
-                    attempt = DeliveryAttempt(
-                        delivery_id=delivery_id,
-                        attempt_number=delivery.attempt_count + 1,
-                        status_code=response.status_code,
-                        response_body=response.text
-                    )
-                    session.add(attempt)
-                    
-                    if response.status_code >= 200 and response.status_code < 300:
-                        # Mark delivery as successful
-                        delivery.status = DeliveryStatus.SUCCESS
-                        set_delivery_status(delivery_id, "success")
-                    else:
-                        # Handle failure with retry
-                        raise Exception(f"HTTP {response.status_code}: {response.text}")
-                    
-            except Exception as e:
-                logger.error(f"Delivery attempt failed: {str(e)}")
-                
-                # Calculate next retry time with exponential backoff
-                retry_delay = min(
-                    settings.INITIAL_RETRY_DELAY * (settings.RETRY_BACKOFF_FACTOR ** self.request.retries),
-                    settings.MAX_RETRY_DELAY
-                )
-                
-                if self.request.retries < settings.MAX_RETRY_ATTEMPTS:
-                    # Schedule retry
-                    delivery.status = DeliveryStatus.RETRYING
-                    delivery.next_retry_at = datetime.utcnow() + timedelta(seconds=retry_delay)
-                    set_delivery_status(delivery_id, "retrying")
-                    raise self.retry(exc=e, countdown=retry_delay)
-                else:
-                    # Mark as failed after max retries
-                    delivery.status = DeliveryStatus.FAILED
-                    set_delivery_status(delivery_id, "failed")
-                    
-            # Update delivery statistics
-            delivery.attempt_count += 1
-            delivery.last_attempt_at = datetime.utcnow()
+            await bulk_insert_attempts(session, [attempt for attempt, _ in results])
+            await update_delivery_states(session, [state for _, state in results])
             await session.commit()
-            
+            return results
         except Exception as e:
-            logger.error(f"Error processing delivery {delivery_id}: {str(e)}")
+            logger.error("Error recording delivery batch, retrying per delivery: %s", e)
             await session.rollback()
-            raise
+
+    recorded = []
+    written = 0
+    error = None
+    async with AsyncSessionLocal() as session:
+        for attempt, state in results:
+            try:
+                await bulk_insert_attempts(session, [attempt])
+                await update_delivery_states(session, [state])
+                await session.commit()
+                recorded.append((attempt, state))
+                written += 1
+                continue
+            except Exception as e:
+                logger.error("Error recording delivery %s: %s", attempt["delivery_id"], e)
+                await session.rollback()
+            try:
+                await fail_deliveries(session, [attempt["delivery_id"]])
+                await session.commit()
+                written += 1
+            except Exception as e:
+                logger.error("Error failing delivery %s: %s", attempt["delivery_id"], e)
+                await session.rollback()
+                error = e
+            recorded.append((attempt, None))
+
+    if not written:
+        raise error
+    return recorded
+
+# Give up on deliveries whose stream entry has failed too many times
+async def dead_letter_deliveries(delivery_ids: List[int]) -> None:
+    async with AsyncSessionLocal() as session:
+        failed = await fail_deliveries(session, delivery_ids)
+        await session.commit()
+    logger.error("Marked deliveries %s failed after repeated stream redelivery", failed)
+
+# Publish every status in a batch in one Redis round trip
+async def publish_delivery_statuses(statuses: List[Tuple[int, int, str]]) -> None:
+    async with cache_pipeline() as pipeline:
+        for subscription_id, delivery_id, status in statuses:
+            await set_delivery_status(subscription_id, delivery_id, status, pipeline)
+
+# Due retries claimed per transaction; consumers still read them in batches
+# of DELIVERY_BATCH_SIZE
+RETRY_CLAIM_SIZE = 1000
+
+# Task to dispatch deliveries whose retry is due
+@celery_app.task
+async def retry_due_deliveries():
+    """Claim due retries and put them back on the delivery stream"""
+    # Keep claiming until the due backlog is drained, so retries are not
+    # capped at one batch per beat interval
+    while True:
+        async with AsyncSessionLocal() as session:
+            delivery_ids = await claim_due_deliveries(session, batch=RETRY_CLAIM_SIZE)
+            # Queue before committing: if the enqueue fails the claim rolls back
+            # and the rows stay due for the next run
+            if delivery_ids:
+                await enqueue_deliveries(delivery_ids)
+            await session.commit()
+        if len(delivery_ids) < RETRY_CLAIM_SIZE:
+            return
 
 # Task to clean up old delivery logs
 @celery_app.task
@@ -134,17 +336,38 @@ async def cleanup_old_logs():
     """Clean up delivery attempts older than retention period"""
     async with AsyncSessionLocal() as session:
         try:
-            # Calculate retention cutoff time
-            retention_period = datetime.utcnow() - timedelta(hours=settings.LOG_RETENTION_HOURS)
+            # Retention cutoff, evaluated against the database clock
+            retention_period = func.now() - timedelta(hours=settings.LOG_RETENTION_HOURS)
             
-            # Delete old delivery attempts
+            # Delete old delivery attempts in a single server-side statement,
+            # a range scan on ix_delivery_attempts_created_at
             await session.execute(
-                select(DeliveryAttempt)
+                delete(DeliveryAttempt)
                 .where(DeliveryAttempt.created_at < retention_period)
-                .delete()
+                .execution_options(synchronize_session=False)
             )
             await session.commit()
         except Exception as e:
-            logger.error(f"Error cleaning up old logs: {str(e)}")
+            logger.error("Error cleaning up old logs: %s", e)
             await session.rollback()
-            raise 
\ No newline at end of file
+            raise 
+
+# Task to prune cached delivery statuses
+@celery_app.task
+async def prune_status_hash():
+    """Drop cached statuses for deliveries older than retention period"""
+    async with AsyncSessionLocal() as session:
+        retention_period = func.now() - timedelta(hours=settings.LOG_RETENTION_HOURS)
+        async for subscription_id, delivery_ids in iter_delivery_status_hashes():
+            if not delivery_ids:
+                continue
+            result = await session.execute(
+                select(WebhookDelivery.id)
+                .where(WebhookDelivery.id.in_(delivery_ids))
+                .where(WebhookDelivery.created_at >= retention_period)
+            )
+            retained = set(result.scalars().all())
+            await delete_delivery_statuses(
+                subscription_id,
+                [delivery_id for delivery_id in delivery_ids if delivery_id not in retained]
+            )
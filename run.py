@@ -20,10 +20,19 @@ def run_command(command):
     return stdout.decode()
 
 def main():
-    # Start Celery worker
+    # Start Celery worker for periodic tasks
     print("Starting Celery worker...")
+    # Tasks are coroutines, so run them on celery-aio-pool's event loop
     celery_process = subprocess.Popen(
-        "celery -A app.worker.celery_app worker --loglevel=info",
+        "celery -A app.worker.celery_app worker --beat --pool=custom --loglevel=info",
+        shell=True,
+        env={**os.environ, "CELERY_CUSTOM_WORKER_POOL": "celery_aio_pool.pool:AsyncIOPool"}
+    )
+    
+    # Start delivery consumer
+    print("Starting delivery consumer...")
+    consumer_process = subprocess.Popen(
+        "python -m app.consumer",
         shell=True
     )
     
@@ -35,12 +44,14 @@ def main():
     )
     
     try:
-        # Keep the script running
-        while True:
-            pass
+        # Sleep until any child exits instead of spinning a CPU core
+        os.wait()
     except KeyboardInterrupt:
+        pass
+    finally:
         print("\nShutting down...")
         celery_process.terminate()
+        consumer_process.terminate()
         fastapi_process.terminate()
 
 if __name__ == "__main__":